@@ -4,123 +4,43 @@ Upload this file to GitHub as: bot.py
 """
 
 import asyncio
+import heapq
+import math
 import os
 import re
 import time
-import threading
-from telegram import Update
+from collections import defaultdict
+from dataclasses import dataclass
+from telegram import InputMediaPhoto, InputMediaVideo, Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.error import TelegramError
+from telegram.error import BadRequest, TelegramError
+from telegram.request import HTTPXRequest
 from media_extractor import MediaExtractor
-from config import TELEGRAM_BOT_TOKEN, MAX_PHOTO_SIZE, MAX_VIDEO_SIZE, AUTO_DELETE_AFTER_HOURS, logger
-from utils import cleanup_temp_file, validate_url, is_image, is_video
-from PIL import Image
+from config import TELEGRAM_BOT_TOKEN, MAX_PHOTO_SIZE, MAX_VIDEO_SIZE, AUTO_DELETE_AFTER_HOURS, SUPPORTED_IMAGE_FORMATS, MAX_CONCURRENT_EXTRACTIONS, logger
+from utils import (cleanup_temp_file, cleanup_temp_dir, validate_url,
+                   is_image, is_video, is_supported_media,
+                   get_filename_from_url, sniff_image_ext)
 
+# URL regex pattern
+_URL_RE = re.compile(
+    r'http[s]?://(?:[a-zA-Z0-9$-_@.&+!*\(\),]|(?:%[0-9a-fA-F]{2}))+')
 
-class TelegramMediaBot:
+# Telegram accepts at most 100 message ids per deleteMessages call
+_DELETE_BATCH_SIZE = 100
 
-    def __init__(self):
-        self.media_extractor = MediaExtractor()
-        self.application = Application.builder().token(
-            TELEGRAM_BOT_TOKEN).build()
-        self.sent_messages = {}  # Track sent messages for auto-deletion
-        self._setup_handlers()
-        self._start_auto_delete_timer()
-
-    def _start_auto_delete_timer(self):
-        """Start the auto-delete timer for sent messages"""
-
-        def auto_delete_worker():
-            while True:
-                current_time = time.time()
-                delete_threshold = AUTO_DELETE_AFTER_HOURS * 3600  # Convert hours to seconds
-
-                messages_to_delete = []
-                for message_key, message_info in self.sent_messages.items():
-                    if current_time - message_info[
-                            'sent_time'] > delete_threshold:
-                        messages_to_delete.append(message_key)
-
-                # Check for messages to warn (5 minutes before deletion)
-                warn_threshold = delete_threshold - 300  # 5 minutes before deletion
-                for message_key, message_info in list(
-                        self.sent_messages.items()):
-                    time_elapsed = current_time - message_info['sent_time']
-
-                    # Send warning if 5 minutes left and not already warned
-                    if (time_elapsed > warn_threshold
-                            and time_elapsed < delete_threshold
-                            and not message_info.get('warned', False)):
-
-                        try:
-                            asyncio.create_task(
-                                self._send_deletion_warning(
-                                    message_info['chat_id'],
-                                    message_info['filename']))
-                            self.sent_messages[message_key]['warned'] = True
-                            logger.info(
-                                f"Sent deletion warning for {message_key}")
-                        except Exception as e:
-                            logger.error(
-                                f"Error sending deletion warning: {e}")
-
-                # Delete expired messages
-                for message_key in messages_to_delete:
-                    try:
-                        message_info = self.sent_messages[message_key]
-                        asyncio.create_task(
-                            self._delete_message(message_info['chat_id'],
-                                                 message_info['message_id']))
-                        del self.sent_messages[message_key]
-                        logger.info(
-                            f"Scheduled deletion of message {message_key}")
-                    except Exception as e:
-                        logger.error(f"Error scheduling message deletion: {e}")
+# Telegram albums hold between 2 and 10 photos/videos
+_MEDIA_GROUP_SIZE = 10
 
-                # Check every 10 minutes
-                time.sleep(600)
+# Album members are read into memory together, so larger files (beyond
+# the Bot API's 50MB upload limit) are sent on their own
+_MEDIA_GROUP_MAX_FILE_SIZE = 50 * 1024 * 1024
 
-        delete_thread = threading.Thread(target=auto_delete_worker,
-                                         daemon=True)
-        delete_thread.start()
+# Caption attached to every sent media file
+_CAPTION_TMPL = ("📎 {name}\n🔗 Source: {source}\n⏰ Auto-deletes in "
+                 f"{AUTO_DELETE_AFTER_HOURS} hour(s)").format
 
-    async def _delete_message(self, chat_id: int, message_id: int):
-        """Delete a message"""
-        try:
-            await self.application.bot.delete_message(chat_id=chat_id,
-                                                      message_id=message_id)
-            logger.info(f"Deleted message {message_id} from chat {chat_id}")
-        except Exception as e:
-            logger.warning(f"Failed to delete message {message_id}: {e}")
-
-    async def _send_deletion_warning(self, chat_id: int, filename: str):
-        """Send warning message before deletion"""
-        try:
-            warning_text = f"⚠️ **Auto-Delete Warning**\n\nYour media file `{filename}` will be automatically deleted in 5 minutes for privacy protection.\n\nIf you need to keep it, please save it now!"
-            await self.application.bot.send_message(chat_id=chat_id,
-                                                    text=warning_text,
-                                                    parse_mode='Markdown')
-            logger.info(
-                f"Sent deletion warning for {filename} to chat {chat_id}")
-        except Exception as e:
-            logger.warning(f"Failed to send deletion warning: {e}")
-
-    def _setup_handlers(self):
-        """Setup bot command and message handlers"""
-        # Command handlers
-        self.application.add_handler(
-            CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-
-        # Message handlers
-        self.application.add_handler(
-            MessageHandler(filters.TEXT & ~filters.COMMAND,
-                           self.handle_url_message))
-
-    async def start_command(self, update: Update,
-                            context: ContextTypes.DEFAULT_TYPE):
-        """Handle /start command"""
-        welcome_message = """
+# Reply texts for /start and /help
+_WELCOME_MSG = """
 🤖 **Media Extractor Bot**
 
 Hi! I can help you extract images and videos from web links.
@@ -139,15 +59,9 @@ Hi! I can help you extract images and videos from web links.
 • /start - Start the bot
 
 Just paste any URL and I'll do the rest! 🚀
-        """
-
-        await update.message.reply_text(welcome_message, parse_mode='Markdown')
-        logger.info(f"User {update.effective_user.id} started the bot")
+"""
 
-    async def help_command(self, update: Update,
-                           context: ContextTypes.DEFAULT_TYPE):
-        """Handle /help command"""
-        help_message = """
+_HELP_MSG = """
 🆘 **Help - Media Extractor Bot**
 
 **How it works:**
@@ -175,9 +89,180 @@ Send me any web URL and I'll extract images and videos from it.
 • `https://news-site.com/article-with-images`
 
 Need more help? Just send me a URL and see what happens! 🎯
-        """
+"""
 
-        await update.message.reply_text(help_message, parse_mode='Markdown')
+
+@dataclass(slots=True)
+class PendingMessage:
+    """A sent message waiting for auto-deletion"""
+    chat_id: int
+    message_id: int
+    sent_time: float
+    filename: str
+
+
+class TelegramMediaBot:
+
+    def __init__(self):
+        self.media_extractor = MediaExtractor()
+        # Larger connection pool so concurrent uploads don't queue, and a
+        # longer read timeout; requests carrying files use
+        # media_write_timeout, so that is the one big uploads need
+        request = HTTPXRequest(connection_pool_size=64,
+                               pool_timeout=30,
+                               read_timeout=120,
+                               media_write_timeout=300)
+        self.application = Application.builder().token(
+            TELEGRAM_BOT_TOKEN).request(request).get_updates_request(
+                HTTPXRequest(connection_pool_size=8)).concurrent_updates(
+                    True).post_init(self._post_init).post_shutdown(
+                        self._post_shutdown).build()
+        # Updates are handled concurrently, but the tracking structures
+        # below are only changed between awaits, so no lock is needed
+        self.sent_messages = {}  # Track sent messages for auto-deletion
+        self._warn_heap = []  # (warn_time, message_key) min-heap
+        self._expiry_heap = []  # (delete_time, message_key) min-heap
+        self._wake = asyncio.Event()  # Set when an earlier deadline is added
+        self._next_wakeup = math.inf
+        self._auto_delete_task = None
+        self._extract_semaphore = asyncio.Semaphore(MAX_CONCURRENT_EXTRACTIONS)
+        self._setup_handlers()
+
+    async def _post_init(self, application: Application):
+        """Start background tasks once the application is initialized"""
+        self._auto_delete_task = asyncio.create_task(self._auto_delete_loop())
+
+    async def _post_shutdown(self, application: Application):
+        """Stop background tasks and release extractor resources"""
+        if self._auto_delete_task:
+            self._auto_delete_task.cancel()
+        self.media_extractor.close()
+
+    def _track_message(self, chat_id: int, message_id: int, filename: str):
+        """Register a sent message for auto-deletion"""
+        message_key = f"{chat_id}_{message_id}"
+        sent_time = time.time()
+        delete_time = sent_time + AUTO_DELETE_AFTER_HOURS * 3600  # Convert hours to seconds
+        warn_time = delete_time - 300  # 5 minutes before deletion
+
+        self.sent_messages[message_key] = PendingMessage(
+            chat_id, message_id, sent_time, filename)
+        heapq.heappush(self._warn_heap, (warn_time, message_key))
+        heapq.heappush(self._expiry_heap, (delete_time, message_key))
+
+        # Wake the auto-delete loop if it is sleeping past this deadline
+        if warn_time < self._next_wakeup:
+            self._wake.set()
+
+    async def _auto_delete_loop(self):
+        """Sweep whenever the next warning or deletion is due"""
+        while True:
+            self._wake.clear()
+            await self._sweep_expired()
+
+            deadlines = [heap[0][0] for heap in
+                         (self._warn_heap, self._expiry_heap) if heap]
+            self._next_wakeup = min(deadlines, default=math.inf)
+            timeout = None
+            if deadlines:
+                timeout = max(0, self._next_wakeup - time.time())
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sweep_expired(self):
+        """Warn about and delete expired messages"""
+        current_time = time.time()
+        delete_threshold = AUTO_DELETE_AFTER_HOURS * 3600  # Convert hours to seconds
+
+        # Pop messages whose warning is due; skip ones already deleted
+        warnings_by_chat = defaultdict(list)
+        while self._warn_heap and self._warn_heap[0][0] <= current_time:
+            _, message_key = heapq.heappop(self._warn_heap)
+            message_info = self.sent_messages.get(message_key)
+            if message_info is None:
+                continue
+
+            # No point warning about a message that is deleted right away
+            if current_time - message_info.sent_time >= delete_threshold:
+                continue
+
+            warnings_by_chat[message_info.chat_id].append(
+                message_info.filename)
+
+        # Pop expired messages
+        deletions_by_chat = defaultdict(list)
+        while self._expiry_heap and self._expiry_heap[0][0] <= current_time:
+            _, message_key = heapq.heappop(self._expiry_heap)
+            message_info = self.sent_messages.pop(message_key, None)
+            if message_info is None:
+                continue
+
+            deletions_by_chat[message_info.chat_id].append(
+                message_info.message_id)
+
+        # One warning and one batched delete request per chat
+        for chat_id, filenames in warnings_by_chat.items():
+            await self._send_deletion_warning(chat_id, filenames)
+
+        for chat_id, message_ids in deletions_by_chat.items():
+            await self._delete_messages(chat_id, message_ids)
+
+    async def _delete_messages(self, chat_id: int, message_ids: list):
+        """Delete messages from a chat, up to 100 per request"""
+        for i in range(0, len(message_ids), _DELETE_BATCH_SIZE):
+            batch = message_ids[i:i + _DELETE_BATCH_SIZE]
+            try:
+                await self.application.bot.delete_messages(
+                    chat_id=chat_id, message_ids=batch)
+                logger.info(
+                    f"Deleted {len(batch)} message(s) from chat {chat_id}")
+            except Exception as e:
+                logger.warning(
+                    f"Failed to delete messages {batch} from chat {chat_id}: {e}"
+                )
+
+    async def _send_deletion_warning(self, chat_id: int, filenames: list):
+        """Send one warning message for the files about to be deleted"""
+        try:
+            shown = ", ".join(f"`{name}`" for name in filenames[:10])
+            if len(filenames) > 10:
+                shown += f" and {len(filenames) - 10} more"
+            noun = "file" if len(filenames) == 1 else "files"
+            warning_text = f"⚠️ **Auto-Delete Warning**\n\nYour media {noun} {shown} will be automatically deleted in 5 minutes for privacy protection.\n\nIf you need to keep it, please save it now!"
+            await self.application.bot.send_message(chat_id=chat_id,
+                                                    text=warning_text,
+                                                    parse_mode='Markdown')
+            logger.info(
+                f"Sent deletion warning for {len(filenames)} file(s) to chat {chat_id}"
+            )
+        except Exception as e:
+            logger.warning(f"Failed to send deletion warning: {e}")
+
+    def _setup_handlers(self):
+        """Setup bot command and message handlers"""
+        # Command handlers
+        self.application.add_handler(
+            CommandHandler("start", self.start_command))
+        self.application.add_handler(CommandHandler("help", self.help_command))
+
+        # Message handlers
+        self.application.add_handler(
+            MessageHandler(filters.TEXT & ~filters.COMMAND,
+                           self.handle_url_message))
+
+    async def start_command(self, update: Update,
+                            context: ContextTypes.DEFAULT_TYPE):
+        """Handle /start command"""
+        await update.message.reply_text(_WELCOME_MSG, parse_mode='Markdown')
+        logger.info(f"User {update.effective_user.id} started the bot")
+
+    async def help_command(self, update: Update,
+                           context: ContextTypes.DEFAULT_TYPE):
+        """Handle /help command"""
+        await update.message.reply_text(_HELP_MSG, parse_mode='Markdown')
 
     async def handle_url_message(self, update: Update,
                                  context: ContextTypes.DEFAULT_TYPE):
@@ -197,23 +282,19 @@ Need more help? Just send me a URL and see what happens! 🎯
             )
             return
 
-        # Process each URL
-        for url in urls[:3]:  # Limit to 3 URLs per message
-            await self._process_url(update, url)
+        # Process URLs concurrently (limit to 3 URLs per message)
+        urls = urls[:3]
+        results = await asyncio.gather(
+            *(self._process_url(update, url) for url in urls),
+            return_exceptions=True)
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error processing URL {url}: {result}")
 
     def _extract_urls(self, text):
         """Extract URLs from text"""
-        # URL regex pattern
-        url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        urls = re.findall(url_pattern, text)
-
-        # Validate URLs
-        valid_urls = []
-        for url in urls:
-            if validate_url(url):
-                valid_urls.append(url)
-
-        return valid_urls
+        # _URL_RE only matches http(s):// URLs, so no extra scheme check
+        return [url for url in _URL_RE.findall(text) if validate_url(url)]
 
     async def _process_url(self, update: Update, url: str):
         """Process a single URL and extract media"""
@@ -225,9 +306,21 @@ Need more help? Just send me a URL and see what happens! 🎯
             f"🔍 Processing URL: {url[:50]}{'...' if len(url) > 50 else ''}\n"
             "Please wait while I extract media...")
 
+        # Source URL as shown in media captions
+        source = url[:100] + ('...' if len(url) > 100 else '')
+
         try:
-            # Extract media
-            media_files = self.media_extractor.extract_media_from_url(url)
+            # Let Telegram fetch direct media links itself, so the file
+            # never passes through this process; download only on failure
+            if is_supported_media(url) and await self._send_media_url(
+                    chat_id, url, source):
+                await processing_msg.edit_text(
+                    f"✅ Successfully sent 1 media file(s) from:\n{url}")
+                return
+
+            # Extract media in a worker thread so the event loop stays free
+            async with self._extract_semaphore:
+                media_files = await self.media_extractor.extract_media_from_url_async(url)
 
             if not media_files:
                 await processing_msg.edit_text(
@@ -241,20 +334,47 @@ Need more help? Just send me a URL and see what happens! 🎯
                 f"📁 Found {len(media_files)} media file(s)!\n"
                 "Uploading to Telegram...")
 
-            # Send media files
-            sent_count = 0
+            # Small photos and videos go out as albums, everything else
+            # one by one
+            album_items = []
+            single_items = []
             for media_info in media_files:
                 try:
-                    success = await self._send_media_file(
-                        chat_id, media_info, url)
-                    if success:
-                        sent_count += 1
-                except Exception as e:
-                    logger.error(f"Error sending media file: {e}")
-                    continue
-                finally:
-                    # Cleanup temp file
+                    media_type = self._resolve_media_type(media_info)
+                except ValueError:
+                    media_type = None  # _send_media_file reports the error
+                if (media_type in ('image', 'video') and
+                        media_info['size'] <= _MEDIA_GROUP_MAX_FILE_SIZE):
+                    album_items.append((media_info, media_type))
+                else:
+                    single_items.append((media_info, media_type))
+
+            # Send media files
+            sent_count = 0
+            try:
+                for i in range(0, len(album_items), _MEDIA_GROUP_SIZE):
+                    batch = album_items[i:i + _MEDIA_GROUP_SIZE]
+                    if len(batch) > 1:
+                        sent_count += await self._send_media_group(
+                            chat_id, batch, source)
+                    else:
+                        single_items.append(batch[0])
+
+                for media_info, media_type in single_items:
+                    try:
+                        success = await self._send_media_file(
+                            chat_id, media_info, source, media_type)
+                        if success:
+                            sent_count += 1
+                    except Exception as e:
+                        logger.error(f"Error sending media file: {e}")
+                        continue
+            finally:
+                # Cleanup temp files
+                for media_info in media_files:
                     cleanup_temp_file(media_info['file_path'])
+                    if media_info.get('temp_dir'):
+                        cleanup_temp_dir(media_info['temp_dir'])
 
             # Update final status
             if sent_count > 0:
@@ -278,102 +398,195 @@ Need more help? Just send me a URL and see what happens! 🎯
                 "Please try with a different URL or check if the link is accessible."
             )
 
+    @staticmethod
+    def _read_file(file_path: str) -> bytes:
+        """Read a media file into memory"""
+        with open(file_path, 'rb') as file:
+            return file.read()
+
     def _validate_image(self, file_path: str) -> bool:
-        """Validate if file is a proper image using PIL"""
+        """Validate if file is a proper image by checking its magic bytes"""
         try:
-            with Image.open(file_path) as img:
-                img.verify()  # Verify the image is valid
-            return True
-        except Exception as e:
+            with open(file_path, 'rb') as f:
+                header = f.read(12)
+        except OSError as e:
             logger.debug(f"Image validation failed for {file_path}: {e}")
             return False
 
-    async def _send_media_file(self, chat_id: int, media_info: dict,
-                               source_url: str):
-        """Send a media file to chat"""
+        return sniff_image_ext(header) is not None
+
+    def _resolve_media_type(self, media_info: dict) -> str:
+        """Decide how a media file is sent: 'image', 'video' or 'document'"""
         file_path = media_info['file_path']
         filename = media_info['filename']
         file_size = media_info['size']
         media_type = media_info['type']
 
-        # Log media type for debugging
-        logger.info(
-            f"Attempting to send {media_type}: {filename} ({file_size} bytes)")
-
-        try:
-            # Double-check if it's an image by file extension and validate
-            if any(filename.lower().endswith(ext) for ext in
-                   ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp']):
-                if self._validate_image(file_path):
-                    media_type = 'image'
-                    logger.info(
-                        f"Corrected media type to 'image' based on filename and validation: {filename}"
-                    )
-                else:
-                    media_type = 'document'
-                    logger.info(
-                        f"Image validation failed, sending as document: {filename}"
-                    )
-
-            # Check file size limits
-            if media_type == 'image' and file_size > MAX_PHOTO_SIZE:
-                # If image is too large for photo, send as document
+        # Double-check if it's an image by file extension and validate,
+        # unless the extractor already agrees with the extension
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in SUPPORTED_IMAGE_FORMATS and media_type != 'image':
+            if self._validate_image(file_path):
+                media_type = 'image'
                 logger.info(
-                    f"Image too large for photo ({file_size} bytes), sending as document"
+                    f"Corrected media type to 'image' based on filename and validation: {filename}"
                 )
+            else:
                 media_type = 'document'
-            elif media_type == 'video' and file_size > MAX_VIDEO_SIZE:
-                raise ValueError(
-                    f"Video too large: {file_size} bytes (max: {MAX_VIDEO_SIZE})"
+                logger.info(
+                    f"Image validation failed, sending as document: {filename}"
                 )
 
-            # Prepare caption
-            caption = f"📎 {filename}\n🔗 Source: {source_url[:100]}{'...' if len(source_url) > 100 else ''}\n⏰ Auto-deletes in {AUTO_DELETE_AFTER_HOURS} hour(s)"
+        # Check file size limits
+        if media_type == 'image' and file_size > MAX_PHOTO_SIZE:
+            # If image is too large for photo, send as document
+            logger.info(
+                f"Image too large for photo ({file_size} bytes), sending as document"
+            )
+            media_type = 'document'
+        elif media_type == 'video' and file_size > MAX_VIDEO_SIZE:
+            raise ValueError(
+                f"Video too large: {file_size} bytes (max: {MAX_VIDEO_SIZE})"
+            )
 
-            sent_message = None
-            with open(file_path, 'rb') as file:
+        return media_type
+
+    async def _send_media_url(self, chat_id: int, url: str,
+                              source: str) -> bool:
+        """Send a direct media URL for Telegram to download"""
+        filename = get_filename_from_url(url)
+        caption = _CAPTION_TMPL(name=filename, source=source)
+
+        try:
+            if is_image(url):
+                logger.info(f"Sending photo by URL: {url}")
+                sent_message = await self.application.bot.send_photo(
+                    chat_id=chat_id, photo=url, caption=caption)
+            else:
+                logger.info(f"Sending video by URL: {url}")
+                sent_message = await self.application.bot.send_video(
+                    chat_id=chat_id, video=url, caption=caption)
+        except BadRequest as e:
+            # Only a rejected URL is worth a download; after a timeout the
+            # message may already be posted, and flood limits apply to
+            # uploads too, so those errors go to the caller
+            logger.info(
+                f"Telegram could not fetch {url}, downloading it instead: {e}")
+            return False
+
+        # Track message for auto-deletion
+        self._track_message(chat_id, sent_message.message_id, filename)
+        return True
+
+    async def _send_media_group(self, chat_id: int, items: list,
+                                source: str) -> int:
+        """Send photos and videos as one album, returns the number sent"""
+        try:
+            media = []
+            for media_info, media_type in items:
+                filename = media_info['filename']
+                file = await asyncio.to_thread(self._read_file,
+                                               media_info['file_path'])
+                caption = _CAPTION_TMPL(name=filename, source=source)
                 if media_type == 'image':
-                    # Send as photo
-                    logger.info("Sending as photo")
-                    try:
-                        sent_message = await self.application.bot.send_photo(
-                            chat_id=chat_id, photo=file, caption=caption)
-                    except TelegramError as e:
-                        if "Image_process_failed" in str(e):
-                            logger.info(
-                                "Image processing failed, falling back to document"
-                            )
-                            file.seek(0)  # Reset file pointer
-                            sent_message = await self.application.bot.send_document(
-                                chat_id=chat_id,
-                                document=file,
-                                caption=caption,
-                                filename=filename)
-                        else:
-                            raise
-                elif media_type == 'video':
-                    # Send as video
-                    logger.info("Sending as video")
-                    sent_message = await self.application.bot.send_video(
-                        chat_id=chat_id, video=file, caption=caption)
+                    media.append(
+                        InputMediaPhoto(file, caption=caption,
+                                        filename=filename))
                 else:
-                    # Send as document
-                    logger.info("Sending as document")
-                    sent_message = await self.application.bot.send_document(
+                    media.append(
+                        InputMediaVideo(file, caption=caption,
+                                        filename=filename))
+
+            logger.info(f"Sending album of {len(media)} media files")
+            sent_messages = await self.application.bot.send_media_group(
+                chat_id=chat_id, media=media)
+        except (BadRequest, OSError) as e:
+            # Only a rejected album or an unreadable file is retried one by
+            # one; after a timeout the album may already be posted, and
+            # flood limits apply to single uploads too
+            logger.warning(
+                f"Album upload failed, sending files one by one: {e}")
+            sent_count = 0
+            for media_info, media_type in items:
+                if await self._send_media_file(chat_id, media_info,
+                                               source, media_type):
+                    sent_count += 1
+            return sent_count
+
+        # Track messages for auto-deletion
+        for sent_message, (media_info, _) in zip(sent_messages, items):
+            self._track_message(chat_id, sent_message.message_id,
+                                media_info['filename'])
+
+        logger.info(f"Successfully sent album of {len(sent_messages)} files")
+        return len(sent_messages)
+
+    async def _send_media_file(self, chat_id: int, media_info: dict,
+                               source: str, media_type: str = None):
+        """Send a media file to chat, as media_type if already resolved"""
+        file_path = media_info['file_path']
+        filename = media_info['filename']
+        file_size = media_info['size']
+
+        # Log media type for debugging
+        logger.info(
+            f"Attempting to send {media_type or media_info['type']}: "
+            f"{filename} ({file_size} bytes)")
+
+        try:
+            if media_type is None:
+                media_type = self._resolve_media_type(media_info)
+
+            # Prepare caption
+            caption = _CAPTION_TMPL(name=filename, source=source)
+
+            # Read the file in a worker thread; PTB would otherwise read
+            # it synchronously on the event loop while building the request
+            file = await asyncio.to_thread(self._read_file, file_path)
+
+            sent_message = None
+            if media_type == 'image':
+                # Send as photo
+                logger.info("Sending as photo")
+                try:
+                    sent_message = await self.application.bot.send_photo(
                         chat_id=chat_id,
-                        document=file,
+                        photo=file,
                         caption=caption,
                         filename=filename)
+                except TelegramError as e:
+                    if "Image_process_failed" in str(e):
+                        logger.info(
+                            "Image processing failed, falling back to document"
+                        )
+                        sent_message = await self.application.bot.send_document(
+                            chat_id=chat_id,
+                            document=file,
+                            caption=caption,
+                            filename=filename)
+                    else:
+                        raise
+            elif media_type == 'video':
+                # Send as video
+                logger.info("Sending as video")
+                sent_message = await self.application.bot.send_video(
+                    chat_id=chat_id,
+                    video=file,
+                    caption=caption,
+                    filename=filename)
+            else:
+                # Send as document
+                logger.info("Sending as document")
+                sent_message = await self.application.bot.send_document(
+                    chat_id=chat_id,
+                    document=file,
+                    caption=caption,
+                    filename=filename)
 
             # Track message for auto-deletion
             if sent_message:
-                message_key = f"{chat_id}_{sent_message.message_id}"
-                self.sent_messages[message_key] = {
-                    'chat_id': chat_id,
-                    'message_id': sent_message.message_id,
-                    'sent_time': time.time(),
-                    'filename': filename
-                }
+                self._track_message(chat_id, sent_message.message_id,
+                                    filename)
 
             logger.info(
                 f"Successfully sent {media_type}: {filename} ({file_size} bytes)"
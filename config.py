@@ -17,11 +17,17 @@ AUTO_DELETE_AFTER_HOURS = 1  # Delete files after 1 hour
 # Download settings
 DOWNLOAD_TIMEOUT = 30  # seconds
 MAX_RETRIES = 3
+MAX_CONCURRENT_EXTRACTIONS = 4  # URLs extracted in parallel
+
+# Temporary files (point BOT_TMPDIR at tmpfs, e.g. /dev/shm/telebot, to skip the disk)
+BOT_TMPDIR = os.getenv("BOT_TMPDIR") or None
+if BOT_TMPDIR:
+    os.makedirs(BOT_TMPDIR, exist_ok=True)
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 
 # Supported formats
-SUPPORTED_IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
-SUPPORTED_VIDEO_FORMATS = {'.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v'}
+SUPPORTED_IMAGE_FORMATS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'})
+SUPPORTED_VIDEO_FORMATS = frozenset({'.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v'})
 
 # Logging configuration
 logging.basicConfig(
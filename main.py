@@ -5,12 +5,19 @@ Telegram Media Extractor Bot
 A Telegram bot that extracts and returns images/videos from web links sent by users.
 """
 
+import os
 import sys
 import signal
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from bot import TelegramMediaBot
 from config import logger, TELEGRAM_BOT_TOKEN
 
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
+
 def signal_handler(sig, frame):
     """Handle shutdown signals"""
     logger.info("Received shutdown signal, stopping bot...")
@@ -28,6 +35,19 @@ def main():
         logger.error("Please set the TELEGRAM_BOT_TOKEN environment variable.")
         sys.exit(1)
     
+    # Use libuv's event loop when available
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("Using uvloop event loop")
+    
+    # Bound the default executor used by asyncio.to_thread so bursts of
+    # extractions and file reads don't spawn dozens of threads
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=min(8, (os.cpu_count() or 1) * 2),
+        thread_name_prefix='bot-io'))
+    asyncio.set_event_loop(loop)
+    
     try:
         # Create and run bot
         bot = TelegramMediaBot()
@@ -1,36 +1,105 @@
+import asyncio
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
 import yt_dlp
 import tempfile
 import os
+import functools
+import itertools
+import threading
 from urllib.parse import urljoin, urlparse
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PIL import Image
 from config import (
     MAX_PHOTO_SIZE, MAX_VIDEO_SIZE, MAX_DOCUMENT_SIZE, 
-    DOWNLOAD_TIMEOUT, MAX_RETRIES, USER_AGENT, logger
+    DOWNLOAD_TIMEOUT, MAX_RETRIES, USER_AGENT, BOT_TMPDIR,
+    SUPPORTED_IMAGE_FORMATS, SUPPORTED_VIDEO_FORMATS, logger
 )
 from utils import (
-    get_file_extension_from_url, get_file_extension_from_content_type,
-    is_supported_media, is_image, is_video, create_temp_file,
-    validate_url, get_filename_from_url
+    describe_url, get_file_extension_from_content_type,
+    is_supported_media, is_video, create_temp_file, cleanup_temp_dir,
+    validate_url, sniff_image_ext, classify_media,
+    canonicalize_media_url, peek_image_dimensions
 )
 
+# Quoted image URLs inside Google Images' inline scripts; bounded
+# quantifiers keep backtracking cheap on large scripts
+GOOGLE_IMAGE_URL_RE = re.compile(
+    r'"(https?://[^"]{1,512}\.(?:jpg|jpeg|png|gif|webp)(?:\?[^"]{0,256})?)"',
+    re.IGNORECASE
+)
+
+# Image hosts worth taking from Google Images results
+GOOGLE_IMAGE_HOSTS = ('googleusercontent.com', 'wikimedia.org')
+
+# Tags inspected by the scraper; everything else is skipped while parsing
+SCRAPED_TAGS = SoupStrainer(['img', 'video', 'source', 'a', 'meta', 'script'])
+
+# Accept header for direct downloads, so servers can refuse with a 406
+# instead of sending an HTML error page
+MEDIA_ACCEPT = 'image/*,video/*,application/octet-stream;q=0.9,*/*;q=0.1'
+
+# Extensions of regular web pages, never worth a HEAD request
+KNOWN_NONMEDIA_EXTS = {'.html', '.htm', '.php', '.asp', '.aspx', '.jsp'}
+
 class MediaExtractor:
     def __init__(self):
         self.session = requests.Session()
-        self.session.headers.update({'User-Agent': USER_AGENT})
+        self.session.headers.update({
+            'User-Agent': USER_AGENT,
+            # gzip/deflate, plus br when the brotli package is installed
+            'Accept-Encoding': requests.utils.DEFAULT_ACCEPT_ENCODING,
+            'Connection': 'keep-alive',
+        })
+        
+        # Keep connections alive across downloads and retry transient errors
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=MAX_RETRIES,
+                backoff_factor=0.3,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD']),
+            ),
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # Remember HEAD results so repeated checks of a URL are free
+        self._check_content_type = functools.lru_cache(maxsize=256)(self._check_content_type)
+        
+        # Shared pool for probing and downloading scraped candidates; the
+        # work is socket-bound, so threads overlap the round trips
+        self._io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='media-io')
         
         # yt-dlp configuration
         self.ydl_opts = {
-            'format': 'best[filesize<50M]',
+            'format': f'best[filesize<{MAX_VIDEO_SIZE}]/best',
+            # The fallback format may have no known size; abort the
+            # download once it grows past the limit
+            'max_filesize': MAX_VIDEO_SIZE,
+            'noplaylist': True,
+            'playlist_items': '1',
             'no_warnings': True,
             'extractaudio': False,
             'audioformat': 'mp3',
             'embed_subtitles': False,
             'writesubtitles': False,
             'writeautomaticsub': False,
+            'outtmpl': '%(title).100s.%(ext)s',
+            # Keep player/signature data between runs
+            'cachedir': os.path.join(BOT_TMPDIR or tempfile.gettempdir(), 'ytdlp-cache'),
         }
+        
+        # YoutubeDL is not thread-safe, so each worker thread keeps its own
+        # long-lived instance instead of building one per URL
+        self._ydl_local = threading.local()
+        self._ydl_instances = []
+        self._ydl_lock = threading.Lock()
     
     def extract_media_from_url(self, url):
         """Main method to extract media from URL"""
@@ -61,28 +130,42 @@ class MediaExtractor:
             logger.error(f"Error extracting media from {url}: {e}")
             raise
     
+    async def extract_media_from_url_async(self, url):
+        """Async variant of extract_media_from_url, run in a worker thread"""
+        return await asyncio.to_thread(self.extract_media_from_url, url)
+    
     def _is_direct_media_url(self, url):
         """Check if URL points directly to media file"""
-        ext = get_file_extension_from_url(url)
-        return is_supported_media(url) or self._check_content_type(url)
-    
-    def _check_content_type(self, url):
-        """Check content-type header to determine if it's media"""
+        ext = describe_url(url).ext
+        if ext in SUPPORTED_IMAGE_FORMATS or ext in SUPPORTED_VIDEO_FORMATS:
+            return True
+        if ext in KNOWN_NONMEDIA_EXTS:
+            return False
+        
+        # Extension is missing or unknown, ask the server; failures are
+        # not cached, so a transient error doesn't stick to the URL
         try:
-            response = self.session.head(url, timeout=10, allow_redirects=True)
-            content_type = response.headers.get('content-type', '').lower()
-            
-            return (content_type.startswith('image/') or 
-                   content_type.startswith('video/') or
-                   'image' in content_type or 'video' in content_type)
+            return self._check_content_type(url)
         except Exception as e:
             logger.debug(f"Error checking content type for {url}: {e}")
             return False
     
+    def _check_content_type(self, url):
+        """Check content-type header to determine if it's media"""
+        response = self.session.head(url, timeout=10, allow_redirects=True)
+        # Error responses (429, 5xx, 405 for HEAD) raise, so they aren't cached
+        response.raise_for_status()
+        content_type = response.headers.get('content-type', '').lower()
+        
+        return (content_type.startswith('image/') or 
+               content_type.startswith('video/') or
+               'image' in content_type or 'video' in content_type)
+    
     def _download_direct_media(self, url):
         """Download media directly from URL"""
         try:
-            response = self.session.get(url, timeout=DOWNLOAD_TIMEOUT, stream=True)
+            response = self.session.get(url, headers={'Accept': MEDIA_ACCEPT},
+                                        timeout=DOWNLOAD_TIMEOUT, stream=True)
             response.raise_for_status()
             
             # Check file size
@@ -92,235 +175,265 @@ class MediaExtractor:
                 if size > MAX_DOCUMENT_SIZE:
                     raise ValueError(f"File too large: {size} bytes (max: {MAX_DOCUMENT_SIZE})")
             
-            # Determine file extension
-            content_type = response.headers.get('content-type')
-            ext = get_file_extension_from_content_type(content_type) or get_file_extension_from_url(url)
-            
-            # Download content
-            content = b''
-            for chunk in response.iter_content(chunk_size=8192):
-                content += chunk
-                if len(content) > MAX_DOCUMENT_SIZE:
-                    raise ValueError("File too large during download")
-            
             # Validate content is actually media, not HTML
             content_type = response.headers.get('content-type', '').lower()
-            if content_type.startswith('text/html') or b'<html' in content[:1000].lower():
+            if content_type.startswith('text/html'):
                 raise ValueError("Downloaded content is HTML, not media")
             
-            # Create temporary file with proper extension
-            filename = get_filename_from_url(url)
-            
-            # Determine proper extension based on content-type
-            if content_type.startswith('image/'):
-                if 'jpeg' in content_type or 'jpg' in content_type:
-                    ext = '.jpg'
-                elif 'png' in content_type:
-                    ext = '.png'
-                elif 'gif' in content_type:
-                    ext = '.gif'
-                elif 'webp' in content_type:
-                    ext = '.webp'
-                else:
-                    ext = '.jpg'  # default for images
+            # Read the first chunk to identify images by their magic bytes
+            chunks = self._iter_media_chunks(response)
+            first_chunk = next(chunks, b'')
+            sniffed_ext = sniff_image_ext(first_chunk[:16])
             
-            temp_path = create_temp_file(content, ext)
+            url_info = describe_url(url)
+            filename = url_info.filename
             
-            # Determine media type more accurately
-            is_image_type = (content_type.startswith('image/') or 
-                           is_image(temp_path) or 
-                           is_image(url) or
-                           any(filename.lower().endswith(img_ext) for img_ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp']))
+            # Trust the magic bytes, then content-type, then the URL
+            ext = sniffed_ext or get_file_extension_from_content_type(content_type)
+            if not ext:
+                ext = '.jpg' if content_type.startswith('image/') else url_info.ext
             
-            is_video_type = (content_type.startswith('video/') or 
-                           is_video(temp_path) or 
-                           is_video(url) or
-                           any(filename.lower().endswith(vid_ext) for vid_ext in ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v']))
+            # Stream the body straight into the temporary file
+            temp_path = create_temp_file(itertools.chain([first_chunk], chunks), ext)
+            size = os.path.getsize(temp_path)
             
-            media_type = 'image' if is_image_type else 'video' if is_video_type else 'document'
+            # Determine media type from content-type, final extension and URL
+            media_type = classify_media(content_type, ext, url_info.ext)
             
             media_info = {
                 'file_path': temp_path,
                 'filename': filename,
-                'size': len(content),
+                'size': size,
                 'type': media_type,
                 'url': url,
                 'content_type': content_type
             }
             
-            logger.info(f"Downloaded direct media: {filename} ({len(content)} bytes)")
+            logger.info(f"Downloaded direct media: {filename} ({size} bytes)")
             return [media_info]
             
         except Exception as e:
             logger.error(f"Error downloading direct media from {url}: {e}")
             raise
     
+    def _iter_media_chunks(self, response):
+        """Yield response body chunks, enforcing size limit and rejecting HTML"""
+        total = 0
+        for chunk in response.iter_content(chunk_size=65536):
+            if total == 0 and b'<html' in chunk[:1024].lower():
+                raise ValueError("Downloaded content is HTML, not media")
+            
+            total += len(chunk)
+            if total > MAX_DOCUMENT_SIZE:
+                raise ValueError("File too large during download")
+            
+            yield chunk
+    
+    def _select_candidates(self, media_urls, unsized_keys, limit=5, max_probes=20):
+        """Pick up to limit URLs in page order, skipping images below 100x100"""
+        candidates = []
+        keys = iter(media_urls)
+        probes_left = max_probes
+        while len(candidates) < limit:
+            batch = list(itertools.islice(keys, limit - len(candidates)))
+            if not batch:
+                break
+            
+            # Images whose size the page didn't declare are checked by
+            # reading only their headers, concurrently within the batch
+            probe_keys = [key for key in batch if key in unsized_keys][:probes_left]
+            probes_left -= len(probe_keys)
+            sizes = dict(zip(probe_keys, self._io_executor.map(
+                lambda key: peek_image_dimensions(self.session, media_urls[key]),
+                probe_keys)))
+            
+            for key in batch:
+                size = sizes.get(key)
+                if size and (size[0] < 100 or size[1] < 100):
+                    logger.debug(f"Skipping small image {media_urls[key]} ({size[0]}x{size[1]})")
+                    continue
+                candidates.append(media_urls[key])
+        return candidates
+    
+    def _try_download_media(self, url):
+        """Download media from URL, returning an empty list on failure"""
+        try:
+            return self._download_direct_media(url)
+        except Exception as e:
+            logger.debug(f"Failed to download media from {url}: {e}")
+            return []
+    
+    def _get_ydl(self):
+        """Get this thread's YoutubeDL instance, creating it on first use"""
+        ydl = getattr(self._ydl_local, 'ydl', None)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(self.ydl_opts)
+            self._ydl_local.ydl = ydl
+            with self._ydl_lock:
+                self._ydl_instances.append(ydl)
+        return ydl
+    
+    def close(self):
+        """Release the worker pool, yt-dlp instances and the HTTP session"""
+        self._io_executor.shutdown(wait=False, cancel_futures=True)
+        with self._ydl_lock:
+            for ydl in self._ydl_instances:
+                ydl.close()
+            self._ydl_instances.clear()
+        self.session.close()
+    
     def _extract_with_ytdlp(self, url):
         """Extract media using yt-dlp"""
+        temp_dir = tempfile.mkdtemp(prefix='ytdlp_', dir=BOT_TMPDIR)
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                # Get info without downloading
-                info = ydl.extract_info(url, download=False)
-                
-                if not info:
-                    return None
-                
-                # Handle playlist
-                if 'entries' in info:
-                    # Take only the first video from playlist
-                    entries = list(info['entries'])
-                    if not entries:
-                        return None
-                    info = entries[0]
-                
-                # Check if it's a supported format
-                formats = info.get('formats', [])
-                if not formats:
+            ydl = self._get_ydl()
+            ydl.params['paths'] = {'home': temp_dir}
+            
+            # Resolve and download in one pass; max_filesize caps the size
+            info = ydl.extract_info(url, download=True)
+            
+            if not info:
+                cleanup_temp_dir(temp_dir)
+                return None
+            
+            # Handle playlist (only the first item is downloaded)
+            if 'entries' in info:
+                entries = [entry for entry in info['entries'] if entry]
+                if not entries:
+                    cleanup_temp_dir(temp_dir)
                     return None
-                
-                # Find best format within size limits
-                best_format = None
-                for fmt in formats:
-                    filesize = fmt.get('filesize') or fmt.get('filesize_approx', 0)
-                    if filesize and filesize <= MAX_VIDEO_SIZE:
-                        if not best_format or (fmt.get('quality', 0) > best_format.get('quality', 0)):
-                            best_format = fmt
-                
-                if not best_format:
-                    # Try without size check
-                    best_format = formats[0] if formats else None
-                
-                if best_format:
-                    # Download the media
-                    temp_dir = tempfile.mkdtemp()
-                    download_opts = self.ydl_opts.copy()
-                    download_opts['outtmpl'] = os.path.join(temp_dir, '%(title)s.%(ext)s')
-                    
-                    with yt_dlp.YoutubeDL(download_opts) as ydl_download:
-                        ydl_download.download([url])
-                    
-                    # Find downloaded file
-                    downloaded_files = []
-                    for file in os.listdir(temp_dir):
-                        file_path = os.path.join(temp_dir, file)
-                        if os.path.isfile(file_path) and is_supported_media(file_path):
-                            file_size = os.path.getsize(file_path)
-                            
-                            media_info = {
-                                'file_path': file_path,
-                                'filename': file,
-                                'size': file_size,
-                                'type': 'video' if is_video(file_path) else 'image',
-                                'url': url,
-                                'title': info.get('title', 'Unknown')
-                            }
-                            downloaded_files.append(media_info)
-                    
-                    if downloaded_files:
-                        logger.info(f"Extracted {len(downloaded_files)} media files using yt-dlp")
-                        return downloaded_files
-                
+                info = entries[0]
+            
+            file_path = ydl.prepare_filename(info)
+            
+            if not os.path.isfile(file_path) or not is_supported_media(file_path):
+                cleanup_temp_dir(temp_dir)
                 return None
+            
+            media_info = {
+                'file_path': file_path,
+                'filename': os.path.basename(file_path),
+                'size': os.path.getsize(file_path),
+                'type': 'video' if is_video(file_path) else 'image',
+                'url': url,
+                'title': info.get('title', 'Unknown'),
+                # Removed together with the file once it has been sent
+                'temp_dir': temp_dir,
+            }
+            
+            logger.info(f"Extracted media file using yt-dlp: {media_info['filename']}")
+            return [media_info]
                 
         except Exception as e:
             logger.debug(f"yt-dlp extraction failed for {url}: {e}")
+            cleanup_temp_dir(temp_dir)
             return None
     
+    def _parse_html(self, response):
+        """Parse only the tags the scraper looks at, preferring lxml"""
+        # Skip encoding detection when the server declares a charset
+        content_type = response.headers.get('content-type', '').lower()
+        encoding = response.encoding if 'charset=' in content_type else None
+        
+        try:
+            return BeautifulSoup(response.content, 'lxml',
+                                 parse_only=SCRAPED_TAGS, from_encoding=encoding)
+        except FeatureNotFound:
+            return BeautifulSoup(response.content, 'html.parser',
+                                 parse_only=SCRAPED_TAGS, from_encoding=encoding)
+    
     def _scrape_media_from_page(self, url):
         """Scrape media URLs from web page"""
         try:
             response = self.session.get(url, timeout=DOWNLOAD_TIMEOUT)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'html.parser')
-            media_urls = set()
+            soup = self._parse_html(response)
+            # Canonical URL -> URL as found on the page; the canonical form
+            # only deduplicates, the original is what gets downloaded
+            media_urls = {}
+            unsized_urls = set()  # Keys of <img> candidates without width/height
             
             # Special handling for Google Images
             if 'google.com' in url and 'tbm=isch' in url:
-                # Extract image URLs from Google Images search results
-                scripts = soup.find_all('script')
-                for script in scripts:
-                    if script.string:
-                        # Look for image URLs in JavaScript data
-                        import re
-                        img_matches = re.findall(r'"(https?://[^"]*\.(?:jpg|jpeg|png|gif|webp)(?:\?[^"]*)?)"', script.string)
-                        for match in img_matches:
-                            if 'googleusercontent.com' in match or 'wikimedia.org' in match:
-                                media_urls.add(match)
-                                if len(media_urls) >= 3:  # Limit Google Images results
-                                    break
-                        if len(media_urls) >= 3:
+                # Extract image URLs from JavaScript data in Google Images
+                # results; a plain substring search skips scripts that
+                # can't contain a wanted host before the regex runs
+                img_matches = (
+                    match.group(1)
+                    for script in soup.find_all('script')
+                    if script.string and any(host in script.string for host in GOOGLE_IMAGE_HOSTS)
+                    for match in GOOGLE_IMAGE_URL_RE.finditer(script.string)
+                )
+                for match in img_matches:
+                    if any(host in match for host in GOOGLE_IMAGE_HOSTS):
+                        media_urls.setdefault(canonicalize_media_url(match), match)
+                        if len(media_urls) >= 3:  # Limit Google Images results
                             break
             
-            # Find images in img tags
-            for img in soup.find_all('img', src=True):
-                src = img.get('src')
-                if src:
+            # Walk the interesting tags once, dispatching on tag name,
+            # instead of searching the whole tree once per tag type
+            og_image_seen = False
+            for tag in soup.find_all(['img', 'video', 'source', 'a', 'meta']):
+                if tag.name == 'img':
+                    # Lazy-loaded images keep the real URL in data-src
+                    data_src = tag.get('data-src')
+                    if data_src:
+                        img_url = urljoin(url, data_src)
+                        if is_supported_media(img_url):
+                            media_urls.setdefault(canonicalize_media_url(img_url), img_url)
+                    
+                    src = tag.get('src')
+                    if not src:
+                        continue
                     img_url = urljoin(url, src)
                     # Skip tiny images and tracking pixels
-                    width = img.get('width')
-                    height = img.get('height')
+                    width = tag.get('width')
+                    height = tag.get('height')
+                    sized = False
                     if width and height:
                         try:
                             w, h = int(width), int(height)
                             if w < 100 or h < 100:  # Skip small images
                                 continue
+                            sized = True
                         except ValueError:
                             pass
                     
                     if is_supported_media(img_url) and 'data:image' not in img_url:
-                        media_urls.add(img_url)
-            
-            # Check data-src attributes (lazy loading)
-            for img in soup.find_all('img', attrs={'data-src': True}):
-                data_src = img.get('data-src')
-                if data_src:
-                    img_url = urljoin(url, data_src)
-                    if is_supported_media(img_url):
-                        media_urls.add(img_url)
-            
-            # Find videos
-            for video in soup.find_all('video', src=True):
-                src = video.get('src')
-                if src:
-                    video_url = urljoin(url, src)
-                    if is_supported_media(video_url):
-                        media_urls.add(video_url)
-            
-            # Find video sources
-            for source in soup.find_all('source', src=True):
-                src = source.get('src')
-                if src:
-                    source_url = urljoin(url, src)
-                    if is_supported_media(source_url):
-                        media_urls.add(source_url)
-            
-            # Find links to media files
-            for link in soup.find_all('a', href=True):
-                href = link.get('href')
-                if href:
-                    link_url = urljoin(url, href)
-                    if is_supported_media(link_url):
-                        media_urls.add(link_url)
-            
-            # Try to find Open Graph images
-            og_image = soup.find('meta', property='og:image')
-            if og_image:
-                content = og_image.get('content')
-                if content:
-                    img_url = urljoin(url, content)
-                    if is_supported_media(img_url):
-                        media_urls.add(img_url)
-            
-            # Download found media
-            downloaded_media = []
-            for media_url in list(media_urls)[:5]:  # Limit to 5 media files
-                try:
-                    media_files = self._download_direct_media(media_url)
-                    downloaded_media.extend(media_files)
-                except Exception as e:
-                    logger.debug(f"Failed to download media from {media_url}: {e}")
+                        img_key = canonicalize_media_url(img_url)
+                        media_urls.setdefault(img_key, img_url)
+                        if not sized:
+                            unsized_urls.add(img_key)
+                    continue
+                
+                if tag.name in ('video', 'source'):
+                    link = tag.get('src')
+                elif tag.name == 'a':
+                    link = tag.get('href')
+                elif tag.get('property') == 'og:image' and not og_image_seen:
+                    # Only the first Open Graph image, as before
+                    og_image_seen = True
+                    link = tag.get('content')
+                else:
                     continue
+                
+                if link:
+                    media_url = urljoin(url, link)
+                    if is_supported_media(media_url):
+                        media_urls.setdefault(canonicalize_media_url(media_url), media_url)
+            
+            # Take the first 5 media files in page order, probing unsized
+            # images only until enough candidates have survived
+            candidate_urls = self._select_candidates(media_urls, unsized_urls)
+            
+            # Download found media concurrently (requests releases the GIL
+            # while waiting on the network)
+            downloaded_media = []
+            futures = [self._io_executor.submit(self._try_download_media, media_url)
+                       for media_url in candidate_urls]
+            for future in as_completed(futures):
+                downloaded_media.extend(future.result())
             
             if downloaded_media:
                 logger.info(f"Scraped {len(downloaded_media)} media files from page")
@@ -1,59 +1,203 @@
 import os
+import shutil
 import tempfile
 import hashlib
-from urllib.parse import urlparse, unquote
-from pathlib import Path
-import mimetypes
-from config import SUPPORTED_IMAGE_FORMATS, SUPPORTED_VIDEO_FORMATS, logger
+import functools
+import struct
+from urllib.parse import urlparse, urlunparse, unquote, parse_qsl, urlencode
+from dataclasses import dataclass
+from config import SUPPORTED_IMAGE_FORMATS, SUPPORTED_VIDEO_FORMATS, BOT_TMPDIR, logger
 
-def get_file_extension_from_url(url):
-    """Extract file extension from URL"""
+# Extensions for the media content types this bot handles; a static map
+# avoids mimetypes loading the system MIME databases
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/pjpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/bmp': '.bmp',
+    'image/x-ms-bmp': '.bmp',
+    'video/mp4': '.mp4',
+    'video/webm': '.webm',
+    'video/quicktime': '.mov',
+    'video/x-matroska': '.mkv',
+    'video/x-msvideo': '.avi',
+    'video/avi': '.avi',
+    'video/x-m4v': '.m4v',
+}
+
+# Query parameters that only track clicks and never change the file served
+TRACKING_QUERY_PARAMS = frozenset({'utm_source', 'utm_medium', 'fbclid', 'gclid', 'ref', '_ga'})
+
+def _path_suffix(path):
+    """Lowercase extension of the last path component, like Path.suffix"""
+    name = path.rstrip('/').rpartition('/')[2]
+    stem, dot, ext = name.rpartition('.')
+    return f'.{ext.lower()}' if stem and ext else ''
+
+@dataclass(frozen=True, slots=True)
+class UrlInfo:
+    """URL parts the extractor needs, computed from a single parse"""
+    scheme: str
+    netloc: str
+    path: str
+    ext: str
+    filename: str
+    
+    @property
+    def is_valid(self):
+        return bool(self.scheme and self.netloc)
+
+@functools.lru_cache(maxsize=8192)
+def describe_url(url):
+    """Parse URL once into scheme, host, path, extension and filename"""
     parsed_url = urlparse(url)
     path = unquote(parsed_url.path)
-    return Path(path).suffix.lower()
+    name = path.rstrip('/').rpartition('/')[2]
+    
+    # If no filename found, generate one
+    if not name or '.' not in name:
+        url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
+        filename = f"media_{url_hash}"
+    else:
+        filename = name
+    
+    return UrlInfo(parsed_url.scheme, parsed_url.netloc, path, _path_suffix(path), filename)
+
+def get_file_extension_from_url(url):
+    """Extract file extension from URL"""
+    return describe_url(url).ext
 
 def get_file_extension_from_content_type(content_type):
     """Get file extension from content-type header"""
     if not content_type:
         return None
     
-    extension = mimetypes.guess_extension(content_type.split(';')[0])
-    return extension.lower() if extension else None
+    return CONTENT_TYPE_EXTENSIONS.get(content_type.split(';', 1)[0].strip().lower())
 
+@functools.lru_cache(maxsize=4096)
 def is_supported_media(file_path_or_url):
     """Check if file is supported media format"""
     if file_path_or_url.startswith('http'):
         ext = get_file_extension_from_url(file_path_or_url)
     else:
-        ext = Path(file_path_or_url).suffix.lower()
+        ext = _path_suffix(os.path.basename(file_path_or_url))
     
     return ext in SUPPORTED_IMAGE_FORMATS or ext in SUPPORTED_VIDEO_FORMATS
 
+@functools.lru_cache(maxsize=4096)
 def is_image(file_path_or_url):
     """Check if file is an image"""
     if file_path_or_url.startswith('http'):
         ext = get_file_extension_from_url(file_path_or_url)
     else:
-        ext = Path(file_path_or_url).suffix.lower()
+        ext = _path_suffix(os.path.basename(file_path_or_url))
     
     return ext in SUPPORTED_IMAGE_FORMATS
 
+@functools.lru_cache(maxsize=4096)
 def is_video(file_path_or_url):
     """Check if file is a video"""
     if file_path_or_url.startswith('http'):
         ext = get_file_extension_from_url(file_path_or_url)
     else:
-        ext = Path(file_path_or_url).suffix.lower()
+        ext = _path_suffix(os.path.basename(file_path_or_url))
     
     return ext in SUPPORTED_VIDEO_FORMATS
 
+def classify_media(content_type, *extensions):
+    """Classify media as 'image', 'video' or 'document'"""
+    if content_type.startswith('image/') or any(ext in SUPPORTED_IMAGE_FORMATS for ext in extensions):
+        return 'image'
+    if content_type.startswith('video/') or any(ext in SUPPORTED_VIDEO_FORMATS for ext in extensions):
+        return 'video'
+    return 'document'
+
+def sniff_image_ext(head):
+    """Detect image format from the first bytes of a file"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return '.gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    if head.startswith(b'BM'):
+        return '.bmp'
+    return None
+
+def get_image_dimensions(head):
+    """Read (width, height) from an image header, or None if unknown"""
+    try:
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return struct.unpack('>II', head[16:24])
+        if head.startswith((b'GIF87a', b'GIF89a')):
+            return struct.unpack('<HH', head[6:10])
+        if head.startswith(b'BM'):
+            width, height = struct.unpack('<ii', head[18:26])
+            return width, abs(height)
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8X':
+                return (1 + int.from_bytes(head[24:27], 'little'),
+                        1 + int.from_bytes(head[27:30], 'little'))
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', head[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b'VP8L':
+                b = head[21:25]
+                return (1 + (((b[1] & 0x3F) << 8) | b[0]),
+                        1 + (((b[3] & 0x0F) << 10) | (b[2] << 2) | ((b[1] & 0xC0) >> 6)))
+            return None
+        if head.startswith(b'\xff\xd8'):
+            # Walk JPEG segments until a start-of-frame marker
+            i = 2
+            while i + 9 <= len(head):
+                if head[i] != 0xFF:
+                    return None
+                marker = head[i + 1]
+                if marker == 0xFF:  # Fill byte
+                    i += 1
+                    continue
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack('>HH', head[i + 5:i + 9])
+                    return width, height
+                i += 2 + struct.unpack('>H', head[i + 2:i + 4])[0]
+    except (struct.error, IndexError):
+        pass
+    return None
+
+def peek_image_dimensions(session, url):
+    """Fetch the first 2 KiB of a remote image and read its dimensions"""
+    try:
+        with session.get(url, headers={'Range': 'bytes=0-2047'}, stream=True, timeout=5) as response:
+            response.raise_for_status()
+            head = response.raw.read(2048, decode_content=True)
+        return get_image_dimensions(head)
+    except Exception as e:
+        logger.debug(f"Could not read image dimensions for {url}: {e}")
+        return None
+
 def create_temp_file(content, extension=None):
-    """Create a temporary file with content"""
+    """Create a temporary file from bytes or an iterable of byte chunks"""
     suffix = extension if extension and extension.startswith('.') else f'.{extension}' if extension else ''
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-        temp_file.write(content)
-        return temp_file.name
+    fd, temp_path = tempfile.mkstemp(suffix=suffix, dir=BOT_TMPDIR)
+    try:
+        # 1 MiB buffer so streamed chunks reach the disk in few syscalls
+        with os.fdopen(fd, 'wb', buffering=1 << 20) as temp_file:
+            if isinstance(content, (bytes, bytearray)):
+                temp_file.write(content)
+            else:
+                for chunk in content:
+                    temp_file.write(chunk)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+    return temp_path
 
 def cleanup_temp_file(file_path):
     """Clean up temporary file"""
@@ -64,14 +208,17 @@ def cleanup_temp_file(file_path):
     except Exception as e:
         logger.warning(f"Failed to cleanup temp file {file_path}: {e}")
 
+def cleanup_temp_dir(dir_path):
+    """Clean up a temporary directory and everything in it"""
+    shutil.rmtree(dir_path, ignore_errors=True)
+    logger.debug(f"Cleaned up temporary directory: {dir_path}")
+
 def get_file_hash(file_path):
-    """Get MD5 hash of file"""
-    hash_md5 = hashlib.md5()
+    """Get BLAKE2b hash of file (16-byte digest, same length as MD5)"""
     try:
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+            digest = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16))
+        return digest.hexdigest()
     except Exception as e:
         logger.error(f"Error calculating file hash: {e}")
         return None
@@ -79,20 +226,27 @@ def get_file_hash(file_path):
 def validate_url(url):
     """Validate if URL is properly formatted"""
     try:
-        result = urlparse(url)
-        return all([result.scheme, result.netloc])
+        return describe_url(url).is_valid
     except Exception:
         return False
 
+@functools.lru_cache(maxsize=4096)
+def canonicalize_media_url(url):
+    """Normalize URL so trivially different links to one file compare equal"""
+    # Only a deduplication key: the query is re-encoded and reordered, so
+    # callers should still fetch the original URL
+    parsed_url = urlparse(url)
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parsed_url.query, keep_blank_values=True)
+        if key not in TRACKING_QUERY_PARAMS and not key.startswith('utm_')
+    ))
+    return urlunparse(parsed_url._replace(
+        scheme=parsed_url.scheme.lower(),
+        netloc=parsed_url.netloc.lower(),
+        query=query,
+        fragment=''
+    ))
+
 def get_filename_from_url(url):
     """Extract filename from URL"""
-    parsed_url = urlparse(url)
-    path = unquote(parsed_url.path)
-    filename = Path(path).name
-    
-    # If no filename found, generate one
-    if not filename or '.' not in filename:
-        url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
-        return f"media_{url_hash}"
-    
-    return filename
+    return describe_url(url).filename